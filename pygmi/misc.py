@@ -578,7 +578,7 @@ class ProgressBarText():
 
             time2 = time.perf_counter()
             curperc = int(i*100/self.total)
-            if curperc > oldperc or oldperc == 0:
+            if curperc > oldperc or i == 1:
                 oldperc = curperc
 
                 tleft = (self.total-i)*(time2-self.otime)/i
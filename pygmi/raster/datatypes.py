@@ -253,7 +253,7 @@ class Data():
 
         self.set_transform(1, 0, 1, 0)
 
-    def copy(self, resetmeta=False):
+    def copy(self, resetmeta=False, copydata=True):
         """
         Make a deepcopy of the function.
 
@@ -261,6 +261,9 @@ class Data():
         ----------
         resetmeta : bool, optional
             This will clear metadata during copy. The default is False.
+        copydata : bool, optional
+            Copy the data array. If False, data is set to None and must be
+            assigned afterwards. The default is True.
 
         Returns
         -------
@@ -270,7 +273,11 @@ class Data():
         """
         data = Data()
         data.__dict__ = {key: deepcopy(value) for key, value in
-                         self.__dict__.items()}
+                         self.__dict__.items()
+                         if copydata or key != 'data'}
+
+        if copydata is False:
+            data.data = None
 
         if resetmeta is True:
             data.metadata = {'Cluster': {}, 'Raster': {'Sensor': 'Generic'}}
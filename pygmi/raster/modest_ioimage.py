@@ -312,8 +312,12 @@ class ModestImage(mi.AxesImage):
             green = datd[tnames[1]].data
             blue = datd[tnames[2]].data
 
-            A = np.ma.array([red, green, blue])
-            A = np.moveaxis(A, 0, 2)
+            # Fill a (rows, cols, 3) array directly, rather than stacking
+            # and moving the band axis, which leaves a strided view.
+            A = np.ma.empty(red.shape+(3,),
+                            dtype=np.result_type(red, green, blue))
+            for i, band in enumerate([red, green, blue]):
+                A[..., i] = band
             self._A = A
 
             if self.rgbclip is None:
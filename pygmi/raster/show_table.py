@@ -48,6 +48,7 @@ class BasicStats(ContextModule):
         self.bands = None
         self.cols = None
         self.data = None
+        self._last_index = -1
 
     def setupui(self):
         """
@@ -82,6 +83,10 @@ class BasicStats(ContextModule):
 
         """
         i = self.cmb_1.currentIndex()
+        if i == self._last_index:
+            return
+        self._last_index = i
+
         data = self.data[i][:, 1:]
 
         for row in range(data.shape[0]):
@@ -137,6 +142,8 @@ class BasicStats(ContextModule):
             fnt.setBold(True)
             item.setFont(fnt)
 
+        # New data, so force the table to be refreshed.
+        self._last_index = -1
         self.combo()
         self.show()
 
@@ -258,15 +265,15 @@ class ClusterStats(ContextModule):
         """
         i = self.cmb_1.currentIndex()
         data = self.data[i]
+        ncols = data.shape[1]
 
         self.tablewidget.setRowCount(len(data))
         rows = ['Class '+str(j+1) for j in range(len(data))]
         self.tablewidget.setVerticalHeaderLabels(rows)
 
-        for row, _ in enumerate(data):
-            for col, _ in enumerate(data[0]):
-                self.tablewidget.setCellWidget(
-                    row, col, QtWidgets.QLabel(str(data[row][col])))
+        for idx, txt in enumerate(data.flat):
+            row, col = divmod(idx, ncols)
+            self.tablewidget.setCellWidget(row, col, QtWidgets.QLabel(txt))
 
         self.tablewidget.resizeColumnsToContents()
 
@@ -300,7 +307,7 @@ class ClusterStats(ContextModule):
             for j, _ in enumerate(val):
                 for k, _ in enumerate(val[0]):
                     val[j][k] = f'{val[j][k]:,.4f} : {std[j][k]:,.4f}'
-            self.data.append(val)
+            self.data.append(np.asarray(val, dtype=object))
 
         data = self.data[0]
         rows = ['Class '+str(j+1) for j in range(len(data))]
@@ -365,7 +372,7 @@ def savetable(ofile, bands, cols, data):
     cols : list
         List of column headings.
     data : list
-        List of arrays containing statistics.
+        List of 2D arrays containing statistics.
 
     Returns
     -------
@@ -380,9 +387,6 @@ def savetable(ofile, bands, cols, data):
         for k, bandsk in enumerate(bands):
             fobj.write(bandsk+'\n')
             fobj.write(htmp+'\n')
-            for i, _ in enumerate(data[k]):
-                rtmp = str(data[k][i][0])
-                for j in range(1, len(data[k][0])):
-                    rtmp += ','+str(data[k][i][j])
-                fobj.write(rtmp+'\n')
+            for row in data[k]:
+                fobj.write(','.join([str(j) for j in row])+'\n')
             fobj.write('\n')
@@ -26,9 +26,11 @@
 
 import os
 import sys
+import copy
 import glob
 import platform
 # from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import Popen, PIPE
 import numpy as np
 from PyQt5 import QtWidgets, QtCore
@@ -37,7 +39,6 @@ from pygmi.raster.misc import lstack, aspect2
 from pygmi.raster.iodefs import get_raster
 from pygmi import menu_default
 from pygmi.misc import BasicModule
-import matplotlib.pyplot as plt
 # import warnings
 
 # warnings.filterwarnings('error')
@@ -402,9 +403,13 @@ def c_correction(data, dem, azimuth, zenith, *, showlog=print, piter=iter):
 
     px, py = np.gradient(dem.data, dem.xdim)
 
-    slope = np.ma.sqrt(px ** 2 + py ** 2)
+    # Work on the raw arrays and attach the mask once, since the np.ma
+    # ufuncs are much slower than their plain numpy equivalents.
+    smask = np.ma.getmaskarray(px) | np.ma.getmaskarray(py)
+    slope = np.hypot(px.data, py.data)
     # slope_deg = np.degrees(np.ma.arctan(slope))
-    s = np.ma.arctan(slope)
+    np.arctan(slope, out=slope)
+    s = np.ma.array(slope, mask=smask)
 
     Z = np.deg2rad(zenith)
     a = np.deg2rad(azimuth)
@@ -419,35 +424,72 @@ def c_correction(data, dem, azimuth, zenith, *, showlog=print, piter=iter):
     cossz = np.cos(Z)
 
     # C
-    data2 = []
-    for Lt in piter(data):
-        Lh = Lt.copy()
+    # Bands are independent and numpy releases the GIL, so run them in
+    # parallel threads. Futures are kept in band order. Each thread holds
+    # full raster temporaries, so the number of threads is capped to
+    # bound memory use, whatever the number of CPUs.
+    workers = max(1, min(4, len(data)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_correct_band, Lt, cosi, cossz)
+                   for Lt in data]
+
+        data2 = []
+        for fut in piter(futures):
+            Lh, c = fut.result()
+            showlog(f'zenith:{zenith} azimuth:{azimuth} c:{c}')
+            data2.append(Lh)
 
-        mask = np.logical_or(cosi.mask, Lt.data.mask)
+    return data2
 
-        x = np.ma.masked_where(mask, cosi)
-        x = x.compressed()
 
-        y = np.ma.masked_where(mask, Lt.data)
-        y = y.compressed()
+def _correct_band(Lt, cosi, cossz):
+    """
+    Apply C correction to a single band.
 
-        m, b = np.polyfit(x, y, 1)
-        c = b/m
+    Parameters
+    ----------
+    Lt : PyGMI Data type
+        Band to be corrected.
+    cosi : numpy masked array
+        Cosine of the solar incidence angle.
+    cossz : float
+        Cosine of the solar zenith angle.
 
-        print(f'zenith:{zenith} azimuth:{azimuth} c:{c}')
-        # plt.figure(dpi=200)
-        # plt.plot(x, y, '.')
-        # trendpoly = np.poly1d((m, b))
-        # plt.plot(x, trendpoly(x))
-        # plt.title(c)
-        # plt.show()
+    Returns
+    -------
+    Lh : PyGMI Data type
+        Corrected band.
+    c : float
+        C correction coefficient.
 
-        Lh.data = Lt.data*(cossz+c)/(cosi+c)
-        Lh.set_mask(mask)
+    """
+    # Shallow copy, since the data array is replaced below.
+    Lh = copy.copy(Lt)
+    Lh.metadata = copy.deepcopy(Lt.metadata)
 
-        data2.append(Lh)
+    mask = np.logical_or(cosi.mask, Lt.data.mask)
 
-    return data2
+    x = np.ma.masked_where(mask, cosi)
+    x = x.compressed()
+
+    y = np.ma.masked_where(mask, Lt.data)
+    y = y.compressed()
+
+    m, b = np.polyfit(x, y, 1)
+    c = b/m
+
+    # plt.figure(dpi=200)
+    # plt.plot(x, y, '.')
+    # trendpoly = np.poly1d((m, b))
+    # plt.plot(x, trendpoly(x))
+    # plt.title(c)
+    # plt.show()
+
+    Lh.data = Lt.data*(cossz+c)
+    Lh.data /= cosi+c
+    Lh.set_mask(mask)
+
+    return Lh, c
 
 
 def _testfn2():
@@ -25,16 +25,24 @@
 """Calculate Landsat composite scenes."""
 
 import os
-import glob
-from datetime import datetime
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from numba import jit, prange
 from PyQt5 import QtWidgets, QtCore
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+from rasterio.windows import Window
 
 from pygmi.rsense.iodefs import get_data
-from pygmi.raster.misc import lstack
 from pygmi.misc import ProgressBarText, BasicModule
 from pygmi import menu_default
 
+TILE_SIZE = 512
+BLOCK_BYTES = 2**20
+
 
 class LandsatComposite(BasicModule):
     """
@@ -50,6 +58,7 @@ class LandsatComposite(BasicModule):
         super().__init__(parent)
 
         self.idir = ''
+        self.ifiles = []
         self.is_import = True
 
         self.sb_tday = QtWidgets.QSpinBox()
@@ -120,10 +129,10 @@ class LandsatComposite(BasicModule):
 
         os.chdir(self.idir)
 
-        ifiles = glob.glob(os.path.join(self.idir, '**/*MTL.txt'),
-                           recursive=True)
+        if not self.ifiles:
+            self.ifiles = find_mtl(self.idir)
 
-        if not ifiles:
+        if not self.ifiles:
             QtWidgets.QMessageBox.warning(self.parent, 'Error',
                                           'No *MTL.txt in the directory or '
                                           'subdirectories.',
@@ -132,7 +141,7 @@ class LandsatComposite(BasicModule):
 
         mean = self.sb_tday.value()
         dat = composite(self.idir, 10, showlog=self.showlog,
-                        piter=self.piter, mean=mean)
+                        piter=self.piter, mean=mean, ifiles=self.ifiles)
 
         self.outdata['Raster'] = dat
 
@@ -151,28 +160,23 @@ class LandsatComposite(BasicModule):
              self.parent, 'Select Directory')
 
         self.le_idirlist.setText(self.idir)
+        self.ifiles = []
 
         if self.idir == '':
             self.idir = None
             return
 
-        ifiles = glob.glob(os.path.join(self.idir, '**/*MTL.txt'),
-                           recursive=True)
+        self.ifiles = find_mtl(self.idir)
 
-        if not ifiles:
+        if not self.ifiles:
             self.showlog('Error: No *MTL.txt in the directory.')
             return
 
-        allday = []
-        for ifile in ifiles:
-            sdate = os.path.basename(ifile).split('_')[3]
-            sdate = datetime.strptime(sdate, '%Y%m%d')
-            datday = sdate.timetuple().tm_yday
-            allday.append(datday)
+        allday = get_doy(self.ifiles)
+        for ifile, datday in zip(self.ifiles, allday):
             self.showlog(f'Scene name: {os.path.basename(ifile)}')
             self.showlog(f'Scene day of year: {datday}')
 
-        allday = np.array(allday)
         mean = int(allday.mean())
 
         self.showlog(f'Mean day: {mean}')
@@ -193,7 +197,8 @@ class LandsatComposite(BasicModule):
         self.saveobj(self.le_idirlist)
 
 
-def composite(idir, dreq=10, mean=None, showlog=print, piter=None):
+def composite(idir, dreq=10, mean=None, showlog=print, piter=None,
+              ifiles=None, ofile=None):
     """
     Create a Landsat composite.
 
@@ -210,6 +215,12 @@ def composite(idir, dreq=10, mean=None, showlog=print, piter=None):
         Function for printing text. The default is print.
     piter : function, optional
         Progress bar iterable. The default is None.
+    ifiles : list, optional
+        List of *MTL.txt files in idir. If not specified, idir is searched.
+        The default is None.
+    ofile : str, optional
+        Output GeoTIFF filename. If specified, the composite is also written
+        to a tiled, LZW compressed GeoTIFF. The default is None.
 
     Returns
     -------
@@ -220,49 +231,85 @@ def composite(idir, dreq=10, mean=None, showlog=print, piter=None):
     if piter is None:
         piter = ProgressBarText().iter
 
-    ifiles = glob.glob(os.path.join(idir, '**/*MTL.txt'), recursive=True)
-
-    allday = []
-    for ifile in ifiles:
-        sdate = os.path.basename(ifile).split('_')[3]
-        sdate = datetime.strptime(sdate, '%Y%m%d')
-        allday.append(sdate.timetuple().tm_yday)
+    if ifiles is None:
+        ifiles = find_mtl(idir)
 
-    allday = np.array(allday)
+    allday = get_doy(ifiles)
     if mean is None:
         mean = allday.mean()
     std = allday.std()
 
-    dat1 = import_and_score(ifiles[0], dreq, mean, std, piter=piter,
-                            showlog=showlog)
+    # The day score is constant for each scene.
+    dayscores = (1/(std*np.sqrt(2*np.pi)) *
+                 np.exp(-0.5*((allday-mean)/std)**2))
+
+    trans, shape = get_grid(ifiles, showlog=showlog, piter=piter)
+
+    # Keep a running best score and the band values of the winning scene.
+    # Each scene is aligned to the output grid once, and the composite is
+    # never restacked. The band arrays are disk backed to limit memory use.
+    best_score = None
+    bands_out = None
+    bands_in = None
+    dat1 = None
+    keys = None
+
+    scenes = _import_scenes(ifiles, dreq, dayscores)
+
+    for j in piter(range(len(ifiles))):
+        ifile = ifiles[j]
+        datday = allday[j]
+        dat, log = next(scenes)
+
+        for txt in log:
+            showlog(txt)
+        showlog(f'Scene name: {os.path.basename(ifile)}')
+        showlog(f'Scene day of year: {datday}')
+
+        if dat1 is None:
+            keys = [key for key in dat if key != 'score']
+            bands_in = _tempmap((len(keys),)+shape)
+
+        score = align_to_grid(dat['score'], trans, shape)
+        for i, key in enumerate(keys):
+            align_to_grid(dat[key], trans, shape, out=bands_in[i])
+
+        # Only the metadata of the first scene is kept for the output.
+        for data in dat.values():
+            data.data = None
 
-    for ifile in ifiles[1:]:
-        dat2 = import_and_score(ifile, dreq, mean, std, piter=piter,
-                                showlog=showlog)
+        # The first scene is used as is, so that pixels without a score
+        # still have data.
+        if dat1 is None:
+            dat1 = dat
+            best_score = score
+            bands_out = _tempmap(bands_in.shape)
+            bands_out[:] = bands_in
+            continue
 
-        tmp1 = {}
-        tmp2 = {}
+        del dat
 
-        for band in dat1:
-            tmp1[band], tmp2[band] = lstack([dat1[band], dat2[band]],
-                                            showlog=showlog, piter=piter)
+        merge_scene(best_score, score, bands_out, bands_in)
 
-        filt = (tmp1['score'].data < tmp2['score'].data)
+        del score
 
-        for band in tmp1:
-            tmp1[band].data[filt] = tmp2[band].data[filt]
+    del bands_in
 
-        dat1 = tmp1
-        del tmp1
-        del tmp2
-        del dat2
+    if ofile is not None:
+        showlog('Writing composite...')
+        write_composite(ofile, bands_out, keys, trans, dat1[keys[0]].crs)
 
     datfin = []
 
-    del dat1['score']
-    for key, data in dat1.items():
+    for i, key in enumerate(keys):
+        data = dat1[key]
+        data.data = np.ma.masked_equal(np.asarray(bands_out[i]), 0)
+        data.nodata = 0
+        data.set_transform(transform=trans)
+        data.dataid = key
         datfin.append(data)
-        datfin[-1].dataid = key
+
+    del bands_out
 
     showlog(f'Range of days for scenes: {allday}')
     showlog(f'Mean day {mean}')
@@ -271,7 +318,403 @@ def composite(idir, dreq=10, mean=None, showlog=print, piter=None):
     return datfin
 
 
-def import_and_score(ifile, dreq, mean, std, *, showlog=print, piter=None):
+def get_doy(ifiles):
+    """
+    Get the day of year of Landsat scenes from their filenames.
+
+    Parameters
+    ----------
+    ifiles : list
+        List of *MTL.txt filenames.
+
+    Returns
+    -------
+    allday : numpy array
+        Day of year for each scene.
+
+    """
+    sdates = (os.path.basename(ifile).split('_')[3] for ifile in ifiles)
+    dates = np.fromiter((f'{i[:4]}-{i[4:6]}-{i[6:8]}' for i in sdates),
+                        dtype='datetime64[D]', count=len(ifiles))
+    allday = (dates - dates.astype('datetime64[Y]')).astype(np.int16) + 1
+
+    return allday
+
+
+def find_mtl(idir):
+    """
+    Find Landsat *MTL.txt files in a directory and its subdirectories.
+
+    Parameters
+    ----------
+    idir : str
+        Input directory.
+
+    Returns
+    -------
+    ifiles : list
+        List of *MTL.txt filenames.
+
+    """
+    ifiles = []
+    stack = [idir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('MTL.txt'):
+                    ifiles.append(entry.path)
+
+    return ifiles
+
+
+def generate_tiling_grid(shape, tile_size, overlap=0):
+    """
+    Generate a grid of tiles covering a 2D array.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array as (rows, cols).
+    tile_size : int
+        Size of each square tile in pixels.
+    overlap : int, optional
+        Number of pixels by which neighbouring tiles overlap. The default
+        is 0.
+
+    Returns
+    -------
+    tiles : list
+        List of (row slice, column slice) tuples.
+
+    """
+    rows, cols = shape[:2]
+    step = tile_size - overlap
+
+    if step < 1:
+        raise ValueError('overlap must be smaller than tile_size')
+
+    tiles = []
+    for i in range(0, rows, step):
+        for j in range(0, cols, step):
+            tiles.append((slice(i, min(i+tile_size, rows)),
+                          slice(j, min(j+tile_size, cols))))
+
+    return tiles
+
+
+def write_composite(ofile, bands, keys, trans, crs, maxtiles=4):
+    """
+    Write a composite to a tiled, LZW compressed GeoTIFF.
+
+    The bands are written window by window, so the composite never has to
+    be held in memory. Tiles are read in the calling thread and written
+    by a single writer thread, since GeoTIFF writes are not thread safe.
+
+    Parameters
+    ----------
+    ofile : str
+        Output filename.
+    bands : numpy array
+        Composite bands, with shape (bands, rows, cols) and zero where there
+        is no data.
+    keys : list
+        Band names.
+    trans : Affine
+        Transform of the output grid.
+    crs : CRS
+        Coordinate reference system of the output grid.
+    maxtiles : int, optional
+        Maximum number of tiles waiting to be written. The default is 4.
+
+    Returns
+    -------
+    None.
+
+    """
+    nbands, rows, cols = bands.shape
+
+    kwargs = {'TILED': 'YES',
+              'BLOCKXSIZE': str(TILE_SIZE),
+              'BLOCKYSIZE': str(TILE_SIZE),
+              'COMPRESS': 'LZW',
+              'PREDICTOR': '3',
+              'BIGTIFF': 'IF_SAFER',
+              'INTERLEAVE': 'BAND'}
+
+    with rasterio.open(ofile, 'w', driver='GTiff', width=cols, height=rows,
+                       count=nbands, dtype=np.float32, transform=trans,
+                       crs=crs, nodata=0, **kwargs) as dst, \
+            ThreadPoolExecutor(max_workers=1) as executor:
+        for i, key in enumerate(keys):
+            dst.set_band_description(i+1, key)
+
+        futures = deque()
+        for i in range(nbands):
+            for rslice, cslice in generate_tiling_grid((rows, cols),
+                                                       TILE_SIZE):
+                win = Window.from_slices(rslice, cslice)
+                tile = np.array(bands[i, rslice, cslice])
+                futures.append(executor.submit(_write_tile, dst, i+1, win,
+                                               tile))
+                if len(futures) > maxtiles:
+                    futures.popleft().result()
+
+        while futures:
+            futures.popleft().result()
+
+
+def _write_tile(dst, band, win, tile):
+    """
+    Write a tile to an open rasterio dataset.
+
+    Parameters
+    ----------
+    dst : rasterio dataset
+        Dataset opened for writing.
+    band : int
+        Band number, starting at 1.
+    win : Window
+        Window to write to.
+    tile : numpy array
+        Tile data.
+
+    Returns
+    -------
+    None.
+
+    """
+    dst.write(tile, band, window=win)
+
+
+def _import_scenes(ifiles, dreq, dayscores, readahead=1):
+    """
+    Import and score scenes in a background thread.
+
+    Scenes are yielded in input order. Scenes are read ahead while the
+    caller merges the current one, but at most readahead scenes are read
+    ahead, whatever the number of CPUs, since each decoded scene can take
+    several GB. Messages are returned rather than displayed, since the
+    display functions are not thread safe.
+
+    Parameters
+    ----------
+    ifiles : list
+        List of input filenames.
+    dreq : int
+        Distance to cloud in pixels.
+    dayscores : numpy array
+        Score for the day of year of each scene.
+    readahead : int, optional
+        Number of scenes read ahead, each in its own thread. The default
+        is 1.
+
+    Yields
+    ------
+    dat : dictionary
+        Dictionary of bands imported.
+    log : list
+        List of messages from the import.
+
+    """
+    readahead = max(1, readahead)
+
+    with ThreadPoolExecutor(max_workers=readahead) as executor:
+        futures = deque()
+        for ifile, dayscore in zip(ifiles, dayscores):
+            if len(futures) < readahead:
+                futures.append(executor.submit(_import_and_log, ifile,
+                                               dreq, dayscore))
+                continue
+            # Start the next scene before handing over the current one, so
+            # that it is read while the caller merges.
+            dat = futures.popleft().result()
+            futures.append(executor.submit(_import_and_log, ifile, dreq,
+                                           dayscore))
+            yield dat
+
+        while futures:
+            yield futures.popleft().result()
+
+
+def _import_and_log(ifile, dreq, dayscore):
+    """
+    Import and score a scene, keeping the messages.
+
+    Parameters
+    ----------
+    ifile : str
+        Input filename.
+    dreq : int
+        Distance to cloud in pixels.
+    dayscore : float
+        Score for the day of year of the scene.
+
+    Returns
+    -------
+    dat : dictionary
+        Dictionary of bands imported.
+    log : list
+        List of messages from the import.
+
+    """
+    log = []
+    dat = import_and_score(ifile, dreq, dayscore, showlog=log.append,
+                           piter=iter)
+
+    return dat, log
+
+
+def _tempmap(shape):
+    """
+    Create a float32 array backed by a temporary file.
+
+    The file is deleted once the array is no longer referenced.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array.
+
+    Returns
+    -------
+    numpy memmap
+        Zero filled array.
+
+    """
+    return np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode='w+',
+                     shape=shape)
+
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def merge_scene(best_score, score, bands_out, bands_in):
+    """
+    Merge a new scene into the composite, based on score.
+
+    Pixels in the composite are replaced by those of the new scene where
+    the new scene has the higher score. On equal scores the pixel of the
+    current composite, which comes from an earlier scene, is kept. The
+    comparison and the copy of all bands are done in a single pass.
+    best_score and bands_out are modified in place.
+
+    Parameters
+    ----------
+    best_score : numpy array
+        Score of the current composite, with shape (rows, cols).
+    score : numpy array
+        Score of the new scene, with shape (rows, cols).
+    bands_out : numpy array
+        Bands of the current composite, with shape (bands, rows, cols).
+    bands_in : numpy array
+        Bands of the new scene, with shape (bands, rows, cols).
+
+    Returns
+    -------
+    None.
+
+    """
+    rows, cols = score.shape
+    numbands = bands_out.shape[0]
+
+    for i in prange(rows):
+        for j in range(cols):
+            if score[i, j] > best_score[i, j]:
+                best_score[i, j] = score[i, j]
+                for k in range(numbands):
+                    bands_out[k, i, j] = bands_in[k, i, j]
+
+
+def get_grid(ifiles, *, showlog=print, piter=None):
+    """
+    Get the output grid covering all scenes.
+
+    The grid is the union of the scene extents, with the smallest cell
+    size of all the scenes.
+
+    Parameters
+    ----------
+    ifiles : list
+        List of input filenames.
+    showlog : function, optional
+        Function for printing text. The default is print.
+    piter : function, optional
+        Progress bar iterable. The default is None.
+
+    Returns
+    -------
+    trans : Affine
+        Transform of the output grid.
+    shape : tuple
+        Shape of the output grid as (rows, cols).
+
+    """
+    xmin = ymin = dxy = np.inf
+    xmax = ymax = -np.inf
+
+    for ifile in ifiles:
+        dat = get_data(ifile, piter=piter, showlog=showlog, metaonly=True)
+        for data in dat:
+            left, right, bottom, top = data.extent
+            xmin = min(xmin, left)
+            xmax = max(xmax, right)
+            ymin = min(ymin, bottom)
+            ymax = max(ymax, top)
+            dxy = min(dxy, data.xdim, data.ydim)
+
+    cols = int((xmax - xmin)/dxy)
+    rows = int((ymax - ymin)/dxy)
+    trans = rasterio.Affine(dxy, 0, xmin, 0, -dxy, ymax)
+
+    return trans, (rows, cols)
+
+
+def align_to_grid(data, trans, shape, out=None):
+    """
+    Align a dataset to a grid, using nearest neighbour resampling.
+
+    Zero is treated as no data.
+
+    Parameters
+    ----------
+    data : PyGMI Data
+        PyGMI dataset.
+    trans : Affine
+        Transform of the output grid.
+    shape : tuple
+        Shape of the output grid as (rows, cols).
+    out : numpy array, optional
+        float32 array to write the output to. The default is None.
+
+    Returns
+    -------
+    odata : numpy array
+        Aligned data, with zero where there is no data.
+
+    """
+    if out is None:
+        odata = np.empty(shape, dtype=np.float32)
+    else:
+        odata = out
+
+    # Scenes from the same path and row share the output grid, so the
+    # values are copied straight across without reprojecting.
+    if data.data.shape == shape and trans.almost_equals(data.transform):
+        np.copyto(odata, data.data.data, casting='unsafe')
+        np.copyto(odata, 0, where=np.ma.getmaskarray(data.data))
+        return odata
+
+    idata = data.data.filled(0).astype(np.float32)
+    odata[...] = 0
+
+    reproject(source=idata, destination=odata, src_transform=data.transform,
+              src_crs=data.crs, src_nodata=0, dst_transform=trans,
+              dst_crs=data.crs, dst_nodata=0, resampling=Resampling.nearest)
+
+    return odata
+
+
+def import_and_score(ifile, dreq, dayscore, *, showlog=print, piter=None):
     """
     Import data and score it.
 
@@ -281,10 +724,8 @@ def import_and_score(ifile, dreq, mean, std, *, showlog=print, piter=None):
         Input filename.
     dreq : int, optional
         Distance to cloud in pixels. The default is 10.
-    mean : float
-        The mean or target day.
-    std : float
-        The standard deviation of all days.
+    dayscore : float
+        Score for the day of year of the scene.
     showlog : function, optional
         Function for printing text. The default is print.
     piter : function, optional
@@ -306,8 +747,12 @@ def import_and_score(ifile, dreq, mean, std, *, showlog=print, piter=None):
 
     for i in tmp:
         if i.dataid in bands:
-            i.data = i.data.astype(np.float32)
-            i.nodata = np.float32(i.nodata)
+            # Calibrated bands are float64 and are reduced to float32.
+            # Uncalibrated DN bands keep their integer type, and are only
+            # cast when they are copied into the composite.
+            if i.data.dtype == np.float64:
+                i.data = i.data.astype(np.float32)
+                i.nodata = np.float32(i.nodata)
             dat[i.dataid] = i
         if 'ST_CDIST' in i.dataid:
             dat['cdist'] = i
@@ -316,34 +761,41 @@ def import_and_score(ifile, dreq, mean, std, *, showlog=print, piter=None):
 
     # CDist calculations
     dmin = 0
-
-    cdist2 = dat['cdist'].data.copy()
-    cdist2[cdist2 > dreq] = dreq
-
-    cdist2 = 1/(1+np.exp(-0.2*(cdist2-(dreq-dmin)/2)))
-
-    # Get day of year
-    sdate = os.path.basename(ifile).split('_')[3]
-    sdate = datetime.strptime(sdate, '%Y%m%d')
-    datday = sdate.timetuple().tm_yday
-    cdistscore = dat['cdist'].copy()
-    cdistscore.data = np.ma.masked_equal(cdist2.filled(0), 0)
+    offset = (dreq-dmin)/2
+
+    # Sigmoid done in place on a single buffer to avoid temporaries. It is
+    # done in blocks of rows so that each block stays in cache.
+    cdist = dat['cdist'].data
+    cdist2 = cdist.filled(dreq)
+    nrows = max(1, BLOCK_BYTES // max(1, cdist2[0].nbytes))
+    for i in range(0, cdist2.shape[0], nrows):
+        tmp = cdist2[i:i+nrows]
+        np.minimum(tmp, dreq, out=tmp)
+        tmp -= offset
+        tmp *= -0.2
+        np.exp(tmp, out=tmp)
+        tmp += 1.
+        np.reciprocal(tmp, out=tmp)
+    cdist2 = np.ma.array(cdist2, mask=np.ma.getmaskarray(cdist))
+
+    cdistscore = dat['cdist'].copy(copydata=False)
+    cdistscore.data = cdist2
     cdistscore.nodata = 0
 
-    dayscore = (1/(std*np.sqrt(2*np.pi)) *
-                np.exp(-0.5*((datday-mean)/std)**2))
     dat['score'] = cdistscore
     dat['score'].data += dayscore
 
-    showlog(f'Scene name: {os.path.basename(ifile)}')
-    showlog(f'Scene day of year: {datday}')
+    # Mask areas with no distance to cloud, keeping existing masks. The
+    # masks are updated in place to avoid fancy indexing on every band.
+    filt = (dat['cdist'].data.data == 0)
+    del dat['cdist']
 
-    filt = (dat['cdist'].data == 0)
     for data in dat.values():
-        data.data[filt] = 0
-        data.data = np.ma.masked_equal(data.data, 0)
-
-    del dat['cdist']
+        if np.ma.getmask(data.data) is np.ma.nomask:
+            data.data.mask = filt
+            continue
+        data.data.unshare_mask()
+        np.logical_or(data.data.mask, filt, out=data.data.mask)
 
     return dat
 
@@ -25,10 +25,12 @@
 """Transforms such as PCA and MNF."""
 
 import os
+import shutil
+import tempfile
 import numpy as np
 from PyQt5 import QtWidgets, QtCore
-from sklearn.decomposition import IncrementalPCA
-import numexpr as ne
+from numba import jit, prange
+from scipy.linalg import eigh, get_blas_funcs
 import matplotlib.pyplot as plt
 
 from pygmi.misc import BasicModule
@@ -471,7 +473,7 @@ def get_noise(x2d, mask, noisetype='', piter=iter):
     Returns
     -------
     nevals : numpy array
-        Noise eigenvalues.
+        Noise eigenvalues, in ascending order.
     nevecs : numpy array
         Noise eigenvectors.
 
@@ -481,59 +483,176 @@ def get_noise(x2d, mask, noisetype='', piter=iter):
     pbar = piter([1, 2, 3])
     next(pbar)
 
+    # The noise is a weighted sum of neighbouring pixels. It is only
+    # calculated where all the pixels used are valid, and is written
+    # straight into a compact (valid pixels x bands) array.
     if noisetype == 'diagonal':
-        t1 = x2d[:-1, :-1]
-        t2 = x2d[1:, 1:]
-        noise = ne.evaluate('t1-t2')
+        weights = np.array([[1., 0.],
+                            [0., -1.]])
+        scale = 1
 
-        mask2 = mask[:-1, :-1]*mask[1:, 1:]
-        noise = noise[mask2]
+    elif noisetype == 'hv average':
+        weights = np.array([[2., -1.],
+                            [-1., 0.]])
+        scale = 4
 
-        ncov = blockwise_cov(noise.T)
+    else:
+        weights = np.array([[1., -2., 1.],
+                            [-2., 4., -2.],
+                            [1., -2., 1.]])
+        scale = 81
+
+    # The stencil is valid where all the pixels it uses are valid. The
+    # shifted masks are combined in place with a logical and.
+    rows = mask.shape[0] - weights.shape[0] + 1
+    cols = mask.shape[1] - weights.shape[1] + 1
+    mask2 = np.ones((rows, cols), dtype=bool)
+    for i, j in zip(*np.nonzero(weights)):
+        mask2 &= mask[i:i+rows, j:j+cols]
+
+    noise = np.empty((np.count_nonzero(mask2), x2d.shape[-1]),
+                     dtype=x2d.dtype)
+    if weights.shape == (3, 3):
+        quad_stencil_noise(x2d, mask2, noise)
+    else:
+        stencil_noise(x2d, mask2, weights, noise)
 
-    elif noisetype == 'hv average':
-        t1 = x2d[:-1, :-1]
-        t2 = x2d[1:, :-1]
-        t3 = x2d[:-1, :-1]
-        t4 = x2d[:-1, 1:]
+    ncov = blockwise_cov(noise.T) / scale
 
-        noise = ne.evaluate('(t1-t2+t3-t4)')
+    del noise
+    next(pbar)
 
-        mask2 = mask[:-1, :-1]*mask[1:, :-1]*mask[:-1, 1:]
+    # The noise covariance is symmetric, so eigh can be used. It is made
+    # exactly symmetric first, to remove round off from the dot product.
+    ncov = (ncov + ncov.T) * 0.5
 
-        noise = noise[mask2]
+    # Calculate evecs and evals. ncov is not needed afterwards, so it can
+    # be overwritten.
+    nevals, nevecs = eigh(ncov, driver='evr', overwrite_a=True,
+                          check_finite=False)
 
-        ncov = blockwise_cov(noise.T) / 4
+    next(pbar)
 
-    else:
-        t1 = x2d[:-2, :-2]
-        t2 = x2d[:-2, 1:-1]
-        t3 = x2d[:-2, 2:]
-        t4 = x2d[1:-1, :-2]
-        t5 = x2d[1:-1, 1:-1]
-        t6 = x2d[1:-1, 2:]
-        t7 = x2d[2:, :-2]
-        t8 = x2d[2:, 1:-1]
-        t9 = x2d[2:, 2:]
+    return nevals, nevecs
 
-        noise = ne.evaluate('(t1-2*t2+t3-2*t4+4*t5-2*t6+t7-2*t8+t9)')
 
-        mask2 = (mask[:-2, :-2] * mask[:-2, 1:-1] * mask[:-2, 2:] *
-                 mask[1:-1, :-2] * mask[1:-1, 1:-1] * mask[1:-1, 2:] *
-                 mask[2:, :-2] * mask[2:, 1:-1] * mask[2:, 2:])
+@jit(nopython=True, parallel=True, cache=True)
+def _row_starts(mask2):
+    """
+    Get the first output row for each row of a mask.
 
-        noise = noise[mask2]
+    Parameters
+    ----------
+    mask2 : numpy array
+        Boolean mask.
 
-        ncov = blockwise_cov(noise.T) / 81
+    Returns
+    -------
+    starts : numpy array
+        Number of True values in mask2 before each row.
 
-    del noise
-    next(pbar)
-    # Calculate evecs and evals
-    nevals, nevecs = np.linalg.eig(ncov)
+    """
+    rows, cols = mask2.shape
 
-    next(pbar)
+    counts = np.zeros(rows, dtype=np.int64)
+    for i in prange(rows):
+        for j in range(cols):
+            if mask2[i, j]:
+                counts[i] += 1
 
-    return nevals, nevecs
+    starts = np.zeros(rows, dtype=np.int64)
+    for i in range(1, rows):
+        starts[i] = starts[i-1] + counts[i-1]
+
+    return starts
+
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def stencil_noise(x2d, mask2, weights, noise):
+    """
+    Calculate noise with a stencil, only where the mask is True.
+
+    Rows are done in parallel. Each row writes to its own block of the
+    output, found from a running count of valid pixels per row.
+
+    Parameters
+    ----------
+    x2d : numpy array
+        Input array, of dimension (MxNxChannels).
+    mask2 : numpy array
+        Boolean mask of valid stencil positions. Its shape is the shape of
+        x2d, less the stencil size plus one.
+    weights : numpy array
+        Stencil weights, of dimension (rows, cols).
+    noise : numpy array
+        Output array, of dimension (number of True values in mask2 x
+        Channels). It is modified in place.
+
+    Returns
+    -------
+    None.
+
+    """
+    rows, cols = mask2.shape
+    wrows, wcols = weights.shape
+    nbands = x2d.shape[2]
+
+    starts = _row_starts(mask2)
+
+    for i in prange(rows):
+        k = starts[i]
+        for j in range(cols):
+            if not mask2[i, j]:
+                continue
+            for b in range(nbands):
+                tmp = 0.
+                for ii in range(wrows):
+                    for jj in range(wcols):
+                        tmp += weights[ii, jj]*x2d[i+ii, j+jj, b]
+                noise[k, b] = tmp
+            k += 1
+
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def quad_stencil_noise(x2d, mask2, noise):
+    """
+    Calculate noise from a local quadratic surface, where the mask is True.
+
+    This is stencil_noise with the nine point stencil written out, so that
+    the sum over neighbours is done on whole rows of bands at a time.
+
+    Parameters
+    ----------
+    x2d : numpy array
+        Input array, of dimension (MxNxChannels).
+    mask2 : numpy array
+        Boolean mask of valid stencil positions, of dimension (M-2xN-2).
+    noise : numpy array
+        Output array, of dimension (number of True values in mask2 x
+        Channels). It is modified in place.
+
+    Returns
+    -------
+    None.
+
+    """
+    rows, cols = mask2.shape
+    nbands = x2d.shape[2]
+
+    starts = _row_starts(mask2)
+
+    for i in prange(rows):
+        k = starts[i]
+        for j in range(cols):
+            if not mask2[i, j]:
+                continue
+            for b in range(nbands):
+                noise[k, b] = (x2d[i, j, b] - 2*x2d[i, j+1, b] +
+                               x2d[i, j+2, b] - 2*x2d[i+1, j, b] +
+                               4*x2d[i+1, j+1, b] - 2*x2d[i+1, j+2, b] +
+                               x2d[i+2, j, b] - 2*x2d[i+2, j+1, b] +
+                               x2d[i+2, j+2, b])
+            k += 1
 
 
 def mnf_calc(dat, *, ncmps=None, noisetxt='hv average', showlog=print, piter=iter,
@@ -566,73 +685,69 @@ def mnf_calc(dat, *, ncmps=None, noisetxt='hv average', showlog=print, piter=ite
         Explained variance, from PCA.
 
     """
-    x2d = []
-    maskall = []
     dat = lstack(dat, piter=piter, showlog=showlog, commonmask=True)
 
-    for j in dat:
-        x2d.append(j.data)
-        maskall.append(j.data.mask)
+    # A single (rows, cols) mask is kept for all the bands.
+    mask = np.ma.getmaskarray(dat[0].data).copy()
+    for j in dat[1:]:
+        mask |= np.ma.getmaskarray(j.data)
+    x2dshape = [*mask.shape, len(dat)]
 
-    maskall = np.moveaxis(maskall, 0, -1)
-    x2d = np.moveaxis(x2d, 0, -1)
-    x2dshape = list(x2d.shape)
+    # Stack straight into (rows, cols, bands) order.
+    x2d = np.empty(x2dshape, dtype=np.float32)
+    for i, j in enumerate(dat):
+        x2d[..., i] = np.ma.getdata(j.data)
 
     for i in dat:
         i.data = None
 
-    mask = maskall[:, :, 0]
-
     showlog('Calculating noise data...')
     nevals, nevecs = get_noise(x2d, mask, noisetxt, piter)
 
     showlog('Calculating MNF...')
-    Ln = np.power(nevals, -0.5)
-    Ln = np.diag(Ln)
-
-    W = np.dot(Ln, nevecs.T)
-
-    x = x2d[~mask]
+    # Clamp tiny or negative noise eigenvalues to avoid NaNs.
+    nevals = np.maximum(nevals, nevals.max()*np.finfo(nevals.dtype).eps)
+    # diag(nevals**-0.5) @ nevecs.T, done as a row scale.
+    sqrt_evals = np.sqrt(nevals)
+    W = (1./sqrt_evals)[:, np.newaxis] * nevecs.T
+    W = W.astype(np.float32)
+
+    valid = np.flatnonzero(~mask)
+    Pnorm = x2d.reshape(-1, x2d.shape[-1])[valid]
     del x2d
 
-    Pnorm = blockwise_dot(x, W.T)
+    # The pixels are whitened in place, so only one (pixels x bands)
+    # array is held at a time.
+    blockwise_dot_inplace(Pnorm, W.T)
 
-    pca = IncrementalPCA(n_components=ncmps)
-
-    iold = 0
     showlog('Fitting PCA')
-    for i in piter(np.linspace(0, Pnorm.shape[0], 20, dtype=int)):
-        if i == 0:
-            continue
-        pca.partial_fit(Pnorm[iold: i])
-        iold = i
+    pca = EighPCA(n_components=ncmps).fit(Pnorm)
 
     showlog('Calculating PCA transform...')
 
-    x2 = np.zeros((Pnorm.shape[0], pca.n_components_))
-    iold = 0
-    for i in piter(np.linspace(0, Pnorm.shape[0], 20, dtype=int)):
-        if i == 0:
-            continue
-        x2[iold: i] = pca.transform(Pnorm[iold: i])
-        iold = i
+    # The data is not needed after this, so it is centred in place
+    # and projected with a single matrix product.
+    x2 = pca.transform(Pnorm, copy=False)
 
-    del Pnorm
     ev = pca.explained_variance_
     evr = pca.explained_variance_ratio_
 
     if fwdonly is False:
         showlog('Calculating inverse MNF...')
-        Winv = np.linalg.inv(W)
-        P = pca.inverse_transform(x2)
-        x2 = blockwise_dot(P, Winv.T)
-        del P
+        # nevecs is orthogonal, so the inverse of W is
+        # nevecs @ diag(sqrt(nevals)), done as a column scale.
+        Winv = nevecs * sqrt_evals[np.newaxis, :]
+        Winv = Winv.astype(np.float32)
+        x2 = pca.inverse_transform(x2, out=Pnorm)
+        blockwise_dot_inplace(x2, Winv.T)
     else:
         x2dshape[-1] = ncmps
-        maskall = maskall[:, :, :ncmps]
+
+    del Pnorm
 
     datall = np.zeros(x2dshape, dtype=np.float32)
-    datall[~mask] = x2
+    datall.reshape(-1, x2dshape[-1])[valid] = x2
+    maskall = np.repeat(mask[:, :, np.newaxis], x2dshape[-1], axis=2)
     datall = np.ma.array(datall, mask=maskall)
 
     del x2
@@ -679,59 +794,42 @@ def pca_calc(dat, ncmps=None,  showlog=print, piter=iter, fwdonly=True):
         Explained variance, from PCA.
 
     """
-    x2d = []
-    maskall = []
     dat = lstack(dat, piter=piter, commonmask=True, showlog=showlog)
 
-    for j in dat:
-        x2d.append(j.data)
-        maskall.append(j.data.mask)
+    # A single (rows, cols) mask is kept for all the bands.
+    mask = np.ma.getmaskarray(dat[0].data).copy()
+    for j in dat[1:]:
+        mask |= np.ma.getmaskarray(j.data)
+    x2dshape = [*mask.shape, len(dat)]
 
-    maskall = np.moveaxis(maskall, 0, -1)
-    x2d = np.moveaxis(x2d, 0, -1)
-    x2dshape = list(x2d.shape)
+    x2d, valid = get_valid_pixels(dat)
 
     for i in dat:
         i.data = None
 
-    mask = maskall[:, :, 0]
-
-    x2d = x2d[~mask]
-
-    pca = IncrementalPCA(n_components=ncmps)
-
-    iold = 0
     showlog('Fitting PCA')
-    for i in piter(np.linspace(0, x2d.shape[0], 20, dtype=int)):
-        if i == 0:
-            continue
-        pca.partial_fit(x2d[iold: i])
-        iold = i
+    pca = EighPCA(n_components=ncmps).fit(x2d)
 
     showlog('Calculating PCA transform...')
 
-    x2 = np.zeros((x2d.shape[0], pca.n_components_))
-    iold = 0
-    for i in piter(np.linspace(0, x2d.shape[0], 20, dtype=int)):
-        if i == 0:
-            continue
-        x2[iold: i] = pca.transform(x2d[iold: i])
-        iold = i
+    # The data is not needed after this, so it is centred in place
+    # and projected with a single matrix product.
+    x2 = pca.transform(x2d, copy=False)
 
-    del x2d
     ev = pca.explained_variance_
     evr = pca.explained_variance_ratio_
 
     if fwdonly is False:
         showlog('Calculating inverse PCA...')
-        x2 = pca.inverse_transform(x2)
+        x2 = pca.inverse_transform(x2, out=x2d)
     else:
         x2dshape[-1] = ncmps
-        maskall = maskall[:, :, :ncmps]
 
-    datall = np.zeros(x2dshape, dtype=np.float32)
+    del x2d
 
-    datall[~mask] = x2
+    datall = np.zeros(x2dshape, dtype=np.float32)
+    datall.reshape(-1, x2dshape[-1])[valid] = x2
+    maskall = np.repeat(mask[:, :, np.newaxis], x2dshape[-1], axis=2)
     datall = np.ma.array(datall, mask=maskall)
 
     del x2
@@ -753,7 +851,7 @@ def pca_calc(dat, ncmps=None,  showlog=print, piter=iter, fwdonly=True):
 
 
 def pca_calc_fitlist(flist, ncmps=None,  showlog=print, piter=iter,
-                     fwdonly=True):
+                     fwdonly=True, batch_size=65536):
     """
     PCA Calculation with using list of files in common fit.
 
@@ -770,6 +868,9 @@ def pca_calc_fitlist(flist, ncmps=None,  showlog=print, piter=iter,
         Iteration function, used for progress bars. The default is iter.
     fwdonly : bool, optional
         Option to perform forward calculation only. The default is True.
+    batch_size : int, optional
+        Number of pixels in each batch used to fit the PCA. The default is
+        65536.
 
     Returns
     -------
@@ -787,113 +888,351 @@ def pca_calc_fitlist(flist, ncmps=None,  showlog=print, piter=iter,
     odir = os.path.join(os.path.dirname(filename), 'PCA')
     os.makedirs(odir, exist_ok=True)
 
-    for ifile in flist:
-        if isinstance(ifile, list):
-            filename = ifile[0].filename
-        else:
-            filename = ifile.filename
+    # A single model is fitted to all the files, one batch at a time.
+    pca = EighPCA(n_components=ncmps)
 
-        showlog('Fitting '+os.path.basename(filename))
+    # Each file is only imported once. Its valid pixels are cached on disk
+    # between the fit and the transform.
+    cdir = tempfile.mkdtemp(prefix='cache', dir=odir)
+    cache = []
 
-        dat = get_from_rastermeta(ifile, piter=piter, showlog=showlog)
+    try:
+        for ifile in flist:
+            if isinstance(ifile, list):
+                filename = ifile[0].filename
+            else:
+                filename = ifile.filename
 
-        x2d = []
-        maskall = []
-        dat = lstack(dat, piter=piter, commonmask=True, showlog=showlog)
+            showlog('Fitting '+os.path.basename(filename))
 
-        for j in dat:
-            x2d.append(j.data)
-            maskall.append(np.ma.getmaskarray(j.data))
+            dat = get_from_rastermeta(ifile, piter=piter, showlog=showlog)
+            dat = lstack(dat, piter=piter, commonmask=True, showlog=showlog)
 
-        maskall = np.moveaxis(maskall, 0, -1)
-        x2d = np.moveaxis(x2d, 0, -1)
-        x2dshape = list(x2d.shape)
+            x2d, _ = get_valid_pixels(dat)
+            mask = np.ma.getmaskarray(dat[0].data)
 
-        mask = maskall[:, :, 0]
+            for i in dat:
+                i.data = None
 
-        x2d = x2d[~mask]
+            cfile = os.path.join(cdir, f'{len(cache)}.npy')
+            np.save(cfile, x2d)
+            cache.append((filename, dat, mask, cfile))
 
-        pca = IncrementalPCA(n_components=ncmps)
+            nbatches = max(1, x2d.shape[0] // batch_size)
+            for xbatch in piter(np.array_split(x2d, nbatches)):
+                pca.partial_fit(xbatch)
 
-        iold = 0
-        for i in piter(np.linspace(0, x2d.shape[0], 20, dtype=int)):
-            if i == 0:
-                continue
-            pca.partial_fit(x2d[iold: i])
-            iold = i
+            del x2d
 
-    for ifile in flist:
-        if isinstance(ifile, list):
-            filename = ifile[0].filename
-        else:
-            filename = ifile.filename
+        for filename, dat, mask, cfile in cache:
+            showlog('Transforming '+os.path.basename(filename))
+            odata = _pca_transform_file(pca, dat, mask, np.load(cfile),
+                                        ncmps, fwdonly, showlog)
+            os.remove(cfile)
+
+            ofile = set_export_filename(dat, odir, 'pca')
+
+            showlog('Exporting '+os.path.basename(ofile))
+            export_raster(ofile, odata, drv='GTiff', piter=piter,
+                          compression='ZSTD', showlog=showlog)
+    finally:
+        shutil.rmtree(cdir, ignore_errors=True)
+
+    ev = pca.explained_variance_
+
+    return odata, ev
+
+
+def _pca_transform_file(pca, dat, mask, x2d, ncmps, fwdonly, showlog):
+    """
+    Transform the valid pixels of a file with a fitted PCA.
+
+    Parameters
+    ----------
+    pca : EighPCA
+        Fitted PCA.
+    dat : list of PyGMI Data.
+        Layer stacked list of PyGMI Data, used for the output metadata.
+    mask : numpy array
+        Common mask of dimension (MxN).
+    x2d : numpy array
+        Valid pixels, of dimension (valid pixels x bands).
+    ncmps : int or None
+        Number of components to use for filtering.
+    fwdonly : bool
+        Option to perform forward calculation only.
+    showlog : function
+        Function for printing text.
 
-        showlog('Transforming '+os.path.basename(filename))
+    Returns
+    -------
+    odata : list of PyGMI Data.
+        Output list of PyGMI Data. Can be forward or inverse transformed data.
 
-        dat = get_from_rastermeta(ifile, piter=piter, showlog=showlog)
+    """
+    x2dshape = [*mask.shape, len(dat)]
+    valid = np.flatnonzero(~mask)
 
-        x2d = []
-        maskall = []
-        dat = lstack(dat, piter=piter, showlog=showlog)
+    # The data is not needed after this, so it is centred in place
+    # and projected with a single matrix product.
+    x2 = pca.transform(x2d, copy=False)
 
-        for j in dat:
-            x2d.append(j.data)
-            maskall.append(np.ma.getmaskarray(j.data))
+    evr = pca.explained_variance_ratio_
 
-        maskall = np.moveaxis(maskall, 0, -1)
-        x2d = np.moveaxis(x2d, 0, -1)
-        x2dshape = list(x2d.shape)
+    if fwdonly is False:
+        showlog('Calculating inverse PCA...')
+        x2 = pca.inverse_transform(x2, out=x2d)
+    else:
+        x2dshape[-1] = ncmps
 
-        mask = maskall[:, :, 0]
+    del x2d
 
-        x2d = x2d[~mask]
+    datall = np.zeros(x2dshape, dtype=np.float32)
+    datall.reshape(-1, x2dshape[-1])[valid] = x2
+    maskall = np.repeat(mask[:, :, np.newaxis], x2dshape[-1], axis=2)
+    datall = np.ma.array(datall, mask=maskall)
 
-        x2 = np.zeros((x2d.shape[0], pca.n_components_))
-        iold = 0
-        for i in piter(np.linspace(0, x2d.shape[0], 20, dtype=int)):
-            if i == 0:
-                continue
-            x2[iold: i] = pca.transform(x2d[iold: i])
-            iold = i
+    del x2
 
-        del x2d
-        ev = pca.explained_variance_
-        evr = pca.explained_variance_ratio_
+    if fwdonly:
+        odata = [i.copy(True) for i in dat]
+        odata = odata[:ncmps]
+    else:
+        odata = [i.copy() for i in dat]
+
+    for j, band in enumerate(odata):
+        band.data = datall[:, :, j]
+        if fwdonly is True:
+            band.dataid = (f'PCA{j+1} Explained Variance Ratio '
+                           f'{evr[j]*100:.2f}%')
+    del datall
+
+    return odata
 
-        if fwdonly is False:
-            showlog('Calculating inverse PCA...')
-            x2 = pca.inverse_transform(x2)
-        else:
-            x2dshape[-1] = ncmps
-            maskall = maskall[:, :, :ncmps]
 
-        datall = np.zeros(x2dshape, dtype=np.float32)
+class EighPCA:
+    """
+    PCA from an eigen decomposition of the covariance matrix.
+
+    When there are many more samples than bands, this is much faster than
+    IncrementalPCA, and it gives the exact result. The data can be
+    fitted in batches with partial_fit, since only sums of the data are
+    kept. It has the same attributes and transform methods as the
+    scikit-learn PCA classes.
+
+    Parameters
+    ----------
+    n_components : int or None, optional
+        Number of components to keep. The default is None (meaning all).
+
+    """
 
-        datall[~mask] = x2
-        datall = np.ma.array(datall, mask=maskall)
+    def __init__(self, n_components=None):
+        self.n_components = n_components
+        self.n_components_ = None
+        self.components_ = None
+        self.mean_ = None
+        self.explained_variance_ = None
+        self.explained_variance_ratio_ = None
+        self.n_samples_seen_ = 0
 
-        del x2
+        self._shift = None
+        self._sum = None
+        self._gram = None
+
+    def fit(self, X, batch_size=65536):
+        """
+        Fit the model.
+
+        Parameters
+        ----------
+        X : numpy array
+            Data, of dimension (samples x bands).
+        batch_size : int, optional
+            Number of samples summed at a time. The default is 65536.
+
+        Returns
+        -------
+        self : EighPCA
+            Fitted model.
+
+        """
+        self.n_samples_seen_ = 0
+        self._shift = None
+
+        for i in range(0, max(1, X.shape[0]), batch_size):
+            self._accumulate(X[i:i+batch_size])
+        self._update()
+
+        return self
+
+    def partial_fit(self, X):
+        """
+        Add a batch of data to the model.
 
-        if fwdonly:
-            odata = [i.copy(True) for i in dat]
-            odata = odata[:ncmps]
+        Parameters
+        ----------
+        X : numpy array
+            Data, of dimension (samples x bands).
+
+        Returns
+        -------
+        self : EighPCA
+            Fitted model.
+
+        """
+        self._accumulate(X)
+        self._update()
+
+        return self
+
+    def _accumulate(self, X):
+        """
+        Add a batch of data to the sums.
+
+        The data is shifted by the mean of the first batch, which keeps the
+        sums small and the covariance accurate.
+
+        Parameters
+        ----------
+        X : numpy array
+            Data, of dimension (samples x bands).
+
+        Returns
+        -------
+        None.
+
+        """
+        if self._shift is None:
+            nbands = X.shape[1]
+            self._shift = X.mean(axis=0, dtype=np.float64)
+            self._sum = np.zeros(nbands)
+            self._gram = np.zeros((nbands, nbands))
+
+        Xs = X - self._shift.astype(X.dtype)
+
+        syrk = get_blas_funcs('syrk', (Xs,))
+        gram = syrk(1., Xs.T)
+
+        self._gram += np.triu(gram) + np.triu(gram, 1).T
+        self._sum += Xs.sum(axis=0, dtype=np.float64)
+        self.n_samples_seen_ += X.shape[0]
+
+    def _update(self):
+        """
+        Update the components from the sums.
+
+        Returns
+        -------
+        None.
+
+        """
+        nsamples = self.n_samples_seen_
+        dmean = self._sum / nsamples
+        cov = (self._gram - nsamples*np.outer(dmean, dmean)) / (nsamples-1)
+
+        evals, evecs = eigh(cov, driver='evr', overwrite_a=True,
+                            check_finite=False)
+        evals = evals[::-1]
+        evecs = evecs[:, ::-1]
+
+        ncmps = self.n_components
+        if ncmps is None:
+            ncmps = cov.shape[0]
+
+        # Make the largest loading of each component positive, so that
+        # the signs of the components are deterministic.
+        components = evecs[:, :ncmps].T
+        signs = np.sign(components[np.arange(ncmps),
+                                   np.abs(components).argmax(axis=1)])
+        components = components * signs[:, np.newaxis]
+
+        evals = np.maximum(evals, 0)
+
+        self.n_components_ = ncmps
+        self.components_ = components
+        self.mean_ = self._shift + dmean
+        self.explained_variance_ = evals[:ncmps]
+        self.explained_variance_ratio_ = evals[:ncmps] / evals.sum()
+
+    def transform(self, X, copy=True):
+        """
+        Project data onto the principal components.
+
+        Parameters
+        ----------
+        X : numpy array
+            Data, of dimension (samples x bands).
+        copy : bool, optional
+            If False, X is centred in place, which avoids a copy of the
+            data. The default is True.
+
+        Returns
+        -------
+        numpy array
+            Transformed data, of dimension (samples x components).
+
+        """
+        mean = self.mean_.astype(X.dtype)
+        if copy:
+            X = X - mean
         else:
-            odata = [i.copy() for i in dat]
+            X -= mean
+
+        return np.dot(X, self.components_.T.astype(X.dtype))
+
+    def inverse_transform(self, X, out=None):
+        """
+        Transform data back to the original space.
 
-        for j, band in enumerate(odata):
-            band.data = datall[:, :, j]
-            if fwdonly is True:
-                band.dataid = (f'PCA{j+1} Explained Variance Ratio '
-                               f'{evr[j]*100:.2f}%')
-        del datall
+        Parameters
+        ----------
+        X : numpy array
+            Transformed data, of dimension (samples x components).
+        out : numpy array, optional
+            C contiguous array of dimension (samples x bands) and the same
+            dtype as X, used for the result. The default is None.
 
-        ofile = set_export_filename(dat, odir, 'pca')
+        Returns
+        -------
+        numpy array
+            Data, of dimension (samples x bands).
 
-        showlog('Exporting '+os.path.basename(ofile))
-        export_raster(ofile, odata, drv='GTiff', piter=piter, compression='ZSTD',
-                      showlog=showlog)
+        """
+        X = np.dot(X, self.components_.astype(X.dtype), out=out)
+        X += self.mean_.astype(X.dtype)
 
-    return odata, ev
+        return X
+
+
+def get_valid_pixels(dat):
+    """
+    Get the valid pixels of layer stacked data as a compact array.
+
+    The valid pixels are those not masked in the first band.
+
+    Parameters
+    ----------
+    dat : list of PyGMI Data.
+        Layer stacked list of PyGMI Data.
+
+    Returns
+    -------
+    x : numpy array
+        float32 valid pixels, of dimension (valid pixels x bands).
+    valid : numpy array
+        Flat indices of the valid pixels.
+
+    """
+    mask = np.ma.getmaskarray(dat[0].data)
+    valid = np.flatnonzero(~mask)
+
+    x = np.empty((valid.size, len(dat)), dtype=np.float32)
+
+    for i, j in enumerate(dat):
+        x[:, i] = np.ma.getdata(j.data).ravel()[valid]
+
+    return x, valid
 
 
 def _block_slices(dim_size, block_size):
@@ -925,27 +1264,79 @@ def _block_slices(dim_size, block_size):
             break
 
 
-def blockwise_cov(A):
+def blockwise_cov(A, block_size=65536):
     """
     Blockwise covariance.
 
     Parameters
     ----------
     A : numpy array
-        Matrix.
+        Matrix, of dimension (variables x samples).
+    block_size : int, optional
+        Number of samples summed at a time. The default is 65536.
 
     Returns
     -------
     ncov : numpy array
-        Covariance matrix.
+        float64 covariance matrix.
 
     """
-    A = A - np.mean(A, axis=1, keepdims=True)
-    ncov = blockwise_dot(A, A.T) / (A.shape[1] - 1)
+    nbands, nsamples = A.shape
+
+    # The covariance comes from shifted sums in a single pass over A, so A
+    # is neither centred nor copied. The shift is the mean of the first
+    # block, which keeps the sums small and the result accurate.
+    shift = A[:, :block_size].mean(axis=1, dtype=np.float64)
+    shift = shift.astype(A.dtype)[:, np.newaxis]
+
+    # The covariance is symmetric, so syrk computes it with half the work
+    # of a general matrix product. Only the upper triangle is returned.
+    # A stays in its own precision, while the sums over blocks of samples
+    # are kept in float64.
+    syrk = get_blas_funcs('syrk', (A,))
+    gram = np.zeros((nbands, nbands))
+    dsum = np.zeros(nbands)
+    for i in range(0, nsamples, block_size):
+        tmp = A[:, i:i+block_size] - shift
+        gram += syrk(1., np.asfortranarray(tmp))
+        dsum += tmp.sum(axis=1, dtype=np.float64)
+
+    gram = np.triu(gram) + np.triu(gram, 1).T
+    dmean = dsum / nsamples
+
+    ncov = (gram - nsamples*np.outer(dmean, dmean)) / (nsamples - 1)
 
     return ncov
 
 
+def blockwise_dot_inplace(A, B, block_rows=65536):
+    """
+    Compute the dot product of two matrices in place, in blocks of rows.
+
+    A is overwritten with the product, so only one block of rows needs
+    temporary storage.
+
+    Parameters
+    ----------
+    A : numpy array
+        MxN matrix. It is overwritten with the output.
+    B : Numpy array
+        NxN matrix.
+    block_rows : int, optional
+        Number of rows of A in a block. The default is 65536.
+
+    Returns
+    -------
+    None.
+
+    """
+    if B.shape != (A.shape[1], A.shape[1]):
+        raise ValueError('matrices are not aligned')
+
+    for i in range(0, A.shape[0], block_rows):
+        A[i:i+block_rows] = np.dot(A[i:i+block_rows], B)
+
+
 def blockwise_dot(A, B, max_elements=int(2**27)):
     """
     Compute the dot product of two matrices in a block-wise fashion.
@@ -988,12 +1379,27 @@ def blockwise_dot(A, B, max_elements=int(2**27)):
 
     out = np.empty((m, o), dtype=np.result_type(A, B))
 
+    # Memory mapped blocks are copied to force a read. In memory arrays
+    # are passed to BLAS as they are.
+    force_read = isinstance(A, np.memmap)
+
+    # The blocks only limit how much of A is read at once. BLAS already
+    # tiles each product for the caches, so when a block of rows covers
+    # all of A's columns the product is written straight into out.
     for mm in _block_slices(m, max_rows):
+        if max_cols >= n:
+            A_block = A[mm]
+            if force_read:
+                A_block = A_block.copy()
+            np.dot(A_block, B.astype(out.dtype, copy=False), out=out[mm])
+            continue
+
         out[mm, :] = 0
         for nn in _block_slices(n, max_cols):
-            A_block = A[mm, nn].copy()  # copy to force a read
+            A_block = A[mm, nn]
+            if force_read:
+                A_block = A_block.copy()
             out[mm, :] += np.dot(A_block, B[nn, :])
-            del A_block
 
     return out
 
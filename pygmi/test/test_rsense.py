@@ -0,0 +1,181 @@
+# -----------------------------------------------------------------------------
+# Name:        test_rsense.py (part of PyGMI)
+#
+# Author:      Patrick Cole
+# E-Mail:      pcole@geoscience.org.za
+#
+# Copyright:   (c) 2019 Council for Geoscience
+# Licence:     GPL-3.0
+#
+# This file is part of PyGMI
+#
+# PyGMI is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyGMI is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+These are tests. Run pytest on this file from within this directory to do
+the tests.
+"""
+
+from datetime import datetime
+import numpy as np
+from pyproj.crs import CRS
+import pytest
+from sklearn.decomposition import PCA
+
+from pygmi.raster.datatypes import Data
+from pygmi.rsense import landsat_composite, transforms
+
+
+@pytest.fixture
+def smalldata():
+    """Small correlated three band dataset, with some pixels masked."""
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(2, 20, 25))
+    mask = np.zeros((20, 25), dtype=bool)
+    mask[:3, :4] = True
+    mask[10, 10:15] = True
+
+    dat = []
+    for i, j in enumerate([[1., 0.5], [0.2, 2.], [1., 1.]]):
+        band = Data()
+        band.dataid = f'band{i+1}'
+        band.data = np.ma.array(100 + j[0]*base[0] + j[1]*base[1] +
+                                0.1*rng.normal(size=(20, 25)), mask=mask)
+        band.set_transform(1, 25, 1, -27)
+        band.crs = CRS.from_epsg(4326)
+        dat.append(band)
+
+    return dat
+
+
+def test_eighpca(smalldata):
+    """Tests EighPCA against scikit-learn PCA, up to the component signs."""
+    x2d, _ = transforms.get_valid_pixels(smalldata)
+    x2d = x2d.astype(np.float64)
+
+    pca = transforms.EighPCA(n_components=2).fit(x2d, batch_size=100)
+    pca2 = PCA(n_components=2).fit(x2d)
+
+    signs = np.sign(np.sum(pca.components_*pca2.components_, axis=1))
+
+    np.testing.assert_allclose(pca.components_*signs[:, np.newaxis],
+                               pca2.components_, atol=1e-8)
+    np.testing.assert_allclose(pca.explained_variance_,
+                               pca2.explained_variance_)
+    np.testing.assert_allclose(pca.explained_variance_ratio_,
+                               pca2.explained_variance_ratio_)
+
+    xpca = pca.transform(x2d)
+    xpca2 = pca2.transform(x2d)
+    np.testing.assert_allclose(xpca*signs, xpca2, atol=1e-8)
+    np.testing.assert_allclose(pca.inverse_transform(xpca),
+                               pca2.inverse_transform(xpca2))
+
+
+def test_pca_calc(smalldata):
+    """Tests pca_calc against scikit-learn PCA on a masked raster."""
+    mask = np.ma.getmaskarray(smalldata[0].data)
+    x2d = np.transpose([np.ma.getdata(i.data)[~mask] for i in smalldata])
+    xpca2 = PCA(n_components=2).fit_transform(x2d)
+
+    odata, _ = transforms.pca_calc([i.copy() for i in smalldata], ncmps=2,
+                                   fwdonly=True)
+    for i, band in enumerate(odata):
+        np.testing.assert_array_equal(band.data.mask, mask)
+        xpca = band.data.data[~mask]
+        xpca = xpca*np.sign(np.dot(xpca, xpca2[:, i]))
+        np.testing.assert_allclose(xpca, xpca2[:, i], atol=1e-3)
+
+    odata, _ = transforms.pca_calc([i.copy() for i in smalldata], ncmps=3,
+                                   fwdonly=False)
+    for band, band2 in zip(odata, smalldata):
+        np.testing.assert_allclose(band.data.data[~mask],
+                                   band2.data.data[~mask], rtol=1e-5)
+
+
+def test_blockwise_cov():
+    """Tests blockwise covariance against numpy."""
+    rng = np.random.default_rng(1)
+    dat = 1000 + rng.normal(size=(3, 1000))
+
+    ncov = transforms.blockwise_cov(dat, block_size=64)
+
+    np.testing.assert_allclose(ncov, np.cov(dat), rtol=1e-10)
+
+
+@pytest.mark.parametrize("noisetype", ['diagonal', 'hv average', ''])
+def test_get_noise(smalldata, noisetype):
+    """Tests MNF noise eigenvalues against direct noise differences."""
+    mask = np.ma.getmaskarray(smalldata[0].data)
+    x2d = np.stack([np.ma.getdata(i.data) for i in smalldata], axis=-1)
+    valid = ~mask
+
+    if noisetype == 'diagonal':
+        noise = x2d[:-1, :-1] - x2d[1:, 1:]
+        mask2 = valid[:-1, :-1] & valid[1:, 1:]
+        scale = 1
+    elif noisetype == 'hv average':
+        noise = 2*x2d[:-1, :-1] - x2d[1:, :-1] - x2d[:-1, 1:]
+        mask2 = valid[:-1, :-1] & valid[1:, :-1] & valid[:-1, 1:]
+        scale = 4
+    else:
+        noise = (x2d[:-2, :-2] - 2*x2d[:-2, 1:-1] + x2d[:-2, 2:] -
+                 2*x2d[1:-1, :-2] + 4*x2d[1:-1, 1:-1] - 2*x2d[1:-1, 2:] +
+                 x2d[2:, :-2] - 2*x2d[2:, 1:-1] + x2d[2:, 2:])
+        mask2 = np.ones(noise.shape[:2], dtype=bool)
+        for i in range(3):
+            for j in range(3):
+                mask2 &= valid[i:i+noise.shape[0], j:j+noise.shape[1]]
+        scale = 81
+
+    nevals2 = np.linalg.eigvalsh(np.cov(noise[mask2].T) / scale)
+
+    nevals, nevecs = transforms.get_noise(x2d, mask, noisetype)
+
+    np.testing.assert_allclose(nevals, nevals2)
+    np.testing.assert_allclose(np.dot(nevecs.T, nevecs), np.eye(3),
+                               atol=1e-10)
+
+
+def test_get_doy():
+    """Tests the day of year from Landsat filenames."""
+    ifiles = ['LC08_L1TP_170078_20200115_20200127_01_T1_MTL.txt',
+              'LE07_L1TP_170078_20161231_20170126_01_T1_MTL.txt',
+              'LC09_L2SP_170078_20240229_20240301_02_T1_MTL.txt']
+
+    allday = landsat_composite.get_doy(ifiles)
+
+    allday2 = [datetime.strptime(i.split('_')[3], '%Y%m%d').timetuple().tm_yday
+               for i in ifiles]
+
+    np.testing.assert_array_equal(allday, allday2)
+
+
+def test_merge_scene():
+    """Tests merging a scene against a masked selection."""
+    rng = np.random.default_rng(2)
+    best_score = rng.random((5, 6)).astype(np.float32)
+    score = rng.random((5, 6)).astype(np.float32)
+    score[0, 0] = best_score[0, 0]
+    bands_out = rng.random((3, 5, 6)).astype(np.float32)
+    bands_in = rng.random((3, 5, 6)).astype(np.float32)
+
+    filt = score > best_score
+    best_score2 = np.where(filt, score, best_score)
+    bands_out2 = np.where(filt, bands_in, bands_out)
+
+    landsat_composite.merge_scene(best_score, score, bands_out, bands_in)
+
+    np.testing.assert_array_equal(best_score, best_score2)
+    np.testing.assert_array_equal(bands_out, bands_out2)
@@ -0,0 +1,136 @@
+# -----------------------------------------------------------------------------
+# Name:        test_vector.py (part of PyGMI)
+#
+# Author:      Patrick Cole
+# E-Mail:      pcole@geoscience.org.za
+#
+# Copyright:   (c) 2019 Council for Geoscience
+# Licence:     GPL-3.0
+#
+# This file is part of PyGMI
+#
+# PyGMI is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyGMI is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# -----------------------------------------------------------------------------
+"""
+These are tests. Run pytest on this file from within this directory to do
+the tests.
+"""
+
+import os
+import sys
+import tempfile
+from PyQt5 import QtWidgets
+import numpy as np
+import pandas as pd
+import pytest
+
+from pygmi.vector import iodefs
+
+APP = QtWidgets.QApplication(sys.argv)  # Necessary to test Qt Classes
+
+
+@pytest.mark.parametrize("txt", [
+    'x,y,mag,mag\n1,2,3,4\n5,6,7,8\n',
+    'x,y,date\n1,2,2020-01-01\n3,4,2020-01-02\n',
+    'x,y,mag,\n1,2,3,\n4,5,6,\n',
+    'x,y,id\n1,2,9007199254740993\n3,4,9007199254740995\n'])
+def test_io_delimited(txt):
+    """Tests delimited files are read as pandas' C engine reads them."""
+    ifile = os.path.join(tempfile.gettempdir(), 'iotest.csv')
+    with open(ifile, 'w', encoding='utf-8') as fno:
+        fno.write(txt)
+
+    tmp = iodefs.ImportXYZ()
+    tmp.ifile = ifile
+    dat = tmp.get_delimited(',')
+
+    dat2 = pd.read_csv(ifile, index_col=False, engine='c', na_values='*')
+    dat2.columns = dat2.columns.str.lower()
+    dat2['line'] = 'None'
+
+    os.unlink(ifile)
+
+    pd.testing.assert_frame_equal(dat, dat2)
+
+
+def test_io_gxyz():
+    """Tests malformed rows in Geosoft XYZ files do not shift other rows."""
+    ifile = os.path.join(tempfile.gettempdir(), 'iotest.xyz')
+    with open(ifile, 'w', encoding='utf-8') as fno:
+        fno.write('/ X Y Mag\n'
+                  'Line 10\n'
+                  '1 2 3 / note\n'
+                  '4 5 6 7\n'
+                  '8 9\n'
+                  'Tie 20\n'
+                  '10 11 *\n'
+                  '12 13 NAN\n')
+
+    log = []
+    dat = iodefs.get_GXYZ(ifile, showlog=log.append)
+
+    os.unlink(ifile)
+
+    dat2 = pd.DataFrame({'X': [1, 8, 10, 12], 'Y': [2, 9, 11, 13],
+                         'Mag': [3., np.nan, np.nan, np.nan],
+                         'line': ['line 10', 'line 10', 'tie 20', 'tie 20']})
+    dat2['line'] = dat2['line'].astype('category')
+
+    pd.testing.assert_frame_equal(dat, dat2)
+    assert len(log) == 1 and 'Warning' in log[0]
+
+
+def test_shrink_dtypes():
+    """Tests numeric columns keep their dtypes and text is categorised."""
+    dat = pd.DataFrame({'x': [500000.5, 500001.5, 500002.5],
+                        'y': [7000000, 7000001, 7000002],
+                        'line': [10, 10, 20],
+                        'name': ['a', 'a', 'a']})
+    dat = iodefs.shrink_dtypes(dat)
+
+    assert dat['x'].dtype == np.float64
+    assert dat['y'].dtype == np.int64
+    assert dat['line'].dtype == np.int64
+    assert isinstance(dat['name'].dtype, pd.CategoricalDtype)
+    assert (dat['y'] * dat['y']).iloc[0] == 7000000**2
+    assert (dat['x'] + 0.01).iloc[0] == 500000.51
+
+
+def test_io_gxyz_columns():
+    """Tests Geosoft XYZ headers, comments and column selection."""
+    ifile = os.path.join(tempfile.gettempdir(), 'iotest.xyz')
+    with open(ifile, 'w', encoding='utf-8') as fno:
+        fno.write('// Exported data\n'
+                  '/ X Y Mag K\n'
+                  'LINE 1\n'
+                  '1 2 3 4\n'
+                  '// inside comment\n'
+                  '5 6 * 8\n'
+                  '  Tie 2\n'
+                  '9 10 11 12\n')
+
+    head = iodefs.get_GXYZ(ifile, headonly=True)
+    dat = iodefs.get_GXYZ(ifile)
+    dat2 = iodefs.get_GXYZ(ifile, usecols=['X', 'Y', 'K'])
+
+    os.unlink(ifile)
+
+    dat3 = pd.DataFrame({'X': [1, 5, 9], 'Y': [2, 6, 10],
+                         'Mag': [3., np.nan, 11.], 'K': [4, 8, 12],
+                         'line': ['line 1', 'line 1', 'tie 2']})
+    dat3['line'] = dat3['line'].astype('category')
+
+    assert head.columns.tolist() == ['X', 'Y', 'Mag', 'K', 'line']
+    pd.testing.assert_frame_equal(dat, dat3)
+    pd.testing.assert_frame_equal(dat2, dat3.drop(columns='Mag'))
@@ -447,7 +447,7 @@ class MyMplCanvas(FigureCanvasQTAgg):
         # Get average spacing between 2 points over the entire survey.
         spcing = np.array([])
 
-        datagrp = data.groupby('line')
+        datagrp = data.groupby('line', observed=True)
         datagrp = list(datagrp)
 
         for line in datagrp:
@@ -26,14 +26,19 @@
 
 import os
 import glob
+import importlib.util
+import itertools
+import mmap
 import re
-from io import StringIO
+from functools import lru_cache
+from io import BytesIO
 
 from PyQt5 import QtWidgets, QtCore
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 import fiona
+from numba import jit
 # from pyogrio import read_info
 
 from pygmi import menu_default
@@ -41,6 +46,16 @@ from pygmi.raster.reproj import GroupProj
 from pygmi.misc import BasicModule, ContextModule
 from pygmi.vector.dataprep import maptobounds
 
+# pyarrow is optional. When it is installed, vector files are read through
+# Arrow buffers.
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+# Null values in Geosoft XYZ files. The default null values of read_csv are
+# case sensitive, so every case of them is listed, which matches them the
+# same way as the lower cased text they were once read from.
+GXYZ_NULLS = ['*'] + sorted({''.join(j) for i in ('nan', '-nan', 'null')
+                             for j in itertools.product(*zip(i, i.upper()))})
+
 
 class ColumnSelect(BasicModule):
     """A combobox to select vector columns."""
@@ -136,7 +151,9 @@ class ImportXYZ(BasicModule):
         self.cmb_xchan = QtWidgets.QComboBox()
         self.cmb_ychan = QtWidgets.QComboBox()
         self.le_nodata = QtWidgets.QLineEdit('99999')
+        self.lw_cols = QtWidgets.QListWidget()
         self.proj = GroupProj('Input Projection')
+        self.channels = None
 
         self.setupui()
 
@@ -156,6 +173,7 @@ class ImportXYZ(BasicModule):
         lbl_xchan = QtWidgets.QLabel('X Channel:')
         lbl_ychan = QtWidgets.QLabel('Y Channel:')
         lbl_nodata = QtWidgets.QLabel('Nodata Value:')
+        lbl_cols = QtWidgets.QLabel('Channels to load:')
 
         buttonbox.setOrientation(QtCore.Qt.Horizontal)
         buttonbox.setCenterButtons(True)
@@ -165,6 +183,7 @@ class ImportXYZ(BasicModule):
         self.cmb_ychan.setSizeAdjustPolicy(3)
         self.cmb_xchan.setMinimumSize = 10
         self.cmb_ychan.setMinimumSize = 10
+        self.lw_cols.setSelectionMode(self.lw_cols.MultiSelection)
 
         self.setWindowTitle(r'Import XYZ Data')
 
@@ -182,6 +201,9 @@ class ImportXYZ(BasicModule):
 
         gl_main.addWidget(self.proj, 3, 0, 1, 4)
 
+        gl_main.addWidget(lbl_cols, 4, 0, 1, 1)
+        gl_main.addWidget(self.lw_cols, 4, 1, 1, 3)
+
         buttonbox.accepted.connect(self.accept)
         buttonbox.rejected.connect(self.reject)
 
@@ -214,25 +236,11 @@ class ImportXYZ(BasicModule):
                 self.parent, 'Open File', '.', ext)
             if self.ifile == '':
                 return False
+            self.channels = None
 
-        if self.filt == 'Geosoft XYZ (*.xyz)':
-            gdf = self.get_GXYZ()
-
-        elif '.xlsx' in self.ifile:
-            gdf = self.get_excel()
-        elif self.filt == 'ASCII XYZ (*.xyz)':
-            gdf = self.get_delimited(' ')
-        elif '.csv' in self.ifile:
-            gdf = self.get_delimited(',')
-        elif self.filt == 'Tab Delimited (*.txt)':
-            gdf = self.get_delimited('\t')
-        elif self.filt == 'Space Delimited (*.txt)':
-            gdf = self.get_delimited(' ')
-        elif self.filt == 'Intrepid Database (*..DIR)':
-            gdf = get_intrepid(self.ifile, self.showlog, self.piter)
-            self.le_nodata.setDisabled(True)
-        else:
-            return False
+        # Only the column names are read here. The data is read once the
+        # channels to load are known.
+        gdf = self.get_data(headonly=True)
 
         if gdf is None:
             return False
@@ -262,14 +270,14 @@ class ImportXYZ(BasicModule):
                 break
 
         if xind == -1:
-            ltmp = ltmp.values
-            # Check for flexible matches
-            for i, tmp in enumerate(ltmp):
-                tmpl = tmp.lower()
-                if 'lon' in tmpl or 'x' in tmpl or 'east' in tmpl:
-                    xind = i
-                if 'lat' in tmpl or 'y' in tmpl or 'north' in tmpl:
-                    yind = i
+            # Check for flexible matches, keeping the last one found.
+            xflex = np.flatnonzero(ltmp.str.contains('lon|x|east', na=False))
+            yflex = np.flatnonzero(ltmp.str.contains('lat|y|north',
+                                                     na=False))
+            if xflex.size > 0:
+                xind = int(xflex[-1])
+            if yflex.size > 0:
+                yind = int(yflex[-1])
 
         if xind == -1:
             xind = 0
@@ -284,6 +292,13 @@ class ImportXYZ(BasicModule):
         self.cmb_xchan.setCurrentIndex(xind)
         self.cmb_ychan.setCurrentIndex(yind)
 
+        self.lw_cols.clear()
+        self.lw_cols.addItems([i for i in gdf.columns.values if i != 'line'])
+        for i in range(self.lw_cols.count()):
+            item = self.lw_cols.item(i)
+            item.setSelected(self.channels is None or
+                             item.text() in self.channels)
+
         if not nodialog:
             tmp = self.exec()
 
@@ -299,6 +314,23 @@ class ImportXYZ(BasicModule):
         xcol = self.cmb_xchan.currentText()
         ycol = self.cmb_ychan.currentText()
 
+        self.channels = [i.text() for i in self.lw_cols.selectedItems()]
+        usecols = set(self.channels + [xcol, ycol, 'line'])
+        if usecols.issuperset(gdf.columns):
+            usecols = None
+        else:
+            usecols = [i for i in gdf.columns if i in usecols]
+
+        if self.filt == 'Intrepid Database (*..DIR)':
+            # Intrepid databases are already fully loaded at this point.
+            if usecols is not None:
+                gdf = gdf[usecols]
+        else:
+            gdf = self.get_data(usecols)
+
+        if gdf is None:
+            return False
+
         x = gdf[xcol]
         y = gdf[ycol]
 
@@ -308,14 +340,35 @@ class ImportXYZ(BasicModule):
 
         gdf = gpd.GeoDataFrame(gdf, geometry=gpd.points_from_xy(x, y))
 
-        gdf['line'] = gdf['line'].astype(str)
+        if not isinstance(gdf['line'].dtype, pd.CategoricalDtype):
+            # Convert only the distinct labels to text, so that a string
+            # is not created for every row.
+            codes, labels = pd.factorize(gdf['line'], use_na_sentinel=False)
+            labels = pd.Index(labels).astype(str)
+            if labels.is_unique:
+                gdf['line'] = pd.Categorical.from_codes(codes, labels)
+            else:
+                gdf['line'] = gdf['line'].astype(str).astype('category')
 
         if self.le_nodata.isEnabled():
-            gdf = gdf.replace(nodata, np.nan)
+            # Only numeric columns can hold the nodata value, so mask
+            # those directly instead of using the generic replace. Float
+            # columns are changed in place where pandas allows it.
+            for col in gdf.select_dtypes(include='number').columns:
+                arr = gdf[col].to_numpy()
+                filt = arr == nodata
+                if not filt.any():
+                    continue
+                if arr.dtype.kind == 'f' and arr.flags.writeable:
+                    np.copyto(arr, np.nan, where=filt)
+                else:
+                    gdf[col] = gdf[col].mask(filt)
 
         if self.proj.wkt != '':
             gdf = gdf.set_crs(self.proj.wkt)
 
+        gdf = shrink_dtypes(gdf)
+
         gdf.attrs['source'] = os.path.basename(self.ifile)
         self.outdata['Vector'] = [gdf]
 
@@ -335,22 +388,68 @@ class ImportXYZ(BasicModule):
         self.saveobj(self.cmb_xchan)
         self.saveobj(self.cmb_ychan)
         self.saveobj(self.le_nodata)
+        self.saveobj(self.channels)
+
+    def get_data(self, usecols=None, headonly=False):
+        """
+        Get data using the reader for the current file type.
+
+        Parameters
+        ----------
+        usecols : list, optional
+            Columns to load. The default is None, which loads all columns.
+        headonly : bool, optional
+            Only read the column names. The default is False.
+
+        Returns
+        -------
+        gdf : DataFrame
+            Pandas dataframe.
 
-    def get_GXYZ(self):
+        """
+        if self.filt == 'Geosoft XYZ (*.xyz)':
+            gdf = self.get_GXYZ(usecols, headonly)
+        elif '.xlsx' in self.ifile:
+            gdf = self.get_excel(usecols, headonly)
+        elif self.filt == 'ASCII XYZ (*.xyz)':
+            gdf = self.get_delimited(' ', usecols, headonly)
+        elif '.csv' in self.ifile:
+            gdf = self.get_delimited(',', usecols, headonly)
+        elif self.filt == 'Tab Delimited (*.txt)':
+            gdf = self.get_delimited('\t', usecols, headonly)
+        elif self.filt == 'Space Delimited (*.txt)':
+            gdf = self.get_delimited(' ', usecols, headonly)
+        elif self.filt == 'Intrepid Database (*..DIR)':
+            gdf = get_intrepid(self.ifile, self.showlog, self.piter)
+            self.le_nodata.setDisabled(True)
+        else:
+            gdf = None
+
+        return gdf
+
+    def get_GXYZ(self, usecols=None, headonly=False):
         """
         Get Geosoft XYZ.
 
+        Parameters
+        ----------
+        usecols : list, optional
+            Columns to load. The default is None, which loads all columns.
+        headonly : bool, optional
+            Only read the column names. The default is False.
+
         Returns
         -------
         df : DataFrame
             Pandas dataframe.
 
         """
-        df = get_GXYZ(self.ifile, self.showlog, self.piter)
+        df = get_GXYZ(self.ifile, self.showlog, self.piter, usecols,
+                      headonly)
 
         return df
 
-    def get_delimited(self, delimiter=','):
+    def get_delimited(self, delimiter=',', usecols=None, headonly=False):
         """
         Get a delimited file.
 
@@ -358,6 +457,11 @@ class ImportXYZ(BasicModule):
         ----------
         delimiter : str, optional
             Delimiter type. The default is ','.
+        usecols : list, optional
+            Lower case columns to load. The default is None, which loads all
+            columns.
+        headonly : bool, optional
+            Only read the column names. The default is False.
 
         Returns
         -------
@@ -365,12 +469,29 @@ class ImportXYZ(BasicModule):
             Pandas dataframe.
 
         """
-        try:
-            gdf = pd.read_csv(self.ifile, delimiter=delimiter,
-                              index_col=False)
-        except:
-            self.showlog('Error reading file.')
-            return None
+        gdf = None
+        if headonly or usecols is not None:
+            try:
+                gdf = pd.read_csv(self.ifile, delimiter=delimiter, nrows=0,
+                                  index_col=False, engine='c')
+            except:
+                self.showlog('Error reading file.')
+                return None
+
+            if usecols is not None:
+                # Map the lower case names back to those in the file.
+                usecols = [i for i in gdf.columns if i.lower() in usecols]
+                gdf = None
+
+        if gdf is None:
+            try:
+                gdf = pd.read_csv(self.ifile, delimiter=delimiter,
+                                  index_col=False, engine='c',
+                                  memory_map=True, na_values='*',
+                                  usecols=usecols)
+            except:
+                self.showlog('Error reading file.')
+                return None
 
         gdf.columns = gdf.columns.str.lower()
 
@@ -379,17 +500,33 @@ class ImportXYZ(BasicModule):
 
         return gdf
 
-    def get_excel(self):
+    def get_excel(self, usecols=None, headonly=False):
         """
         Get an Excel spreadsheet.
 
+        Parameters
+        ----------
+        usecols : list, optional
+            Lower case columns to load. The default is None, which loads all
+            columns.
+        headonly : bool, optional
+            Only read the column names. The default is False.
+
         Returns
         -------
         gdf : Dataframe
             Pandas dataframe.
 
         """
-        gdf = pd.read_excel(self.ifile)
+        nrows = None
+        if headonly:
+            nrows = 0
+        if usecols is not None:
+            # Map the lower case names back to those in the file.
+            head = pd.read_excel(self.ifile, nrows=0).columns
+            usecols = [i for i in head if str(i).lower() in usecols]
+
+        gdf = pd.read_excel(self.ifile, nrows=nrows, usecols=usecols)
 
         gdf.columns = gdf.columns.str.lower()
 
@@ -442,19 +579,19 @@ class ExportXYZ(ContextModule):
         filt = (data.columns != 'geometry')
         cols = list(data.columns[filt])
 
-        # from https://stackoverflow.com/questions/64695352/pandas-to-csv-
-        # progress-bar-with-tqdm
-        chunks = np.array_split(data.index, 100)  # split into 100 chunks
-        chunks = [i for i in chunks if i.size > 0]
-
         if filename[-3:] == 'csv':
-            for chunck, subset in enumerate(self.piter(chunks)):
-                if chunck == 0:  # first row
-                    data.loc[subset].to_csv(filename, mode='w', index=False,
-                                            columns=cols)
-                else:
-                    data.loc[subset].to_csv(filename, header=None, mode='a',
-                                            index=False, columns=cols)
+            dfall = pd.DataFrame(data[cols])
+
+            # from https://stackoverflow.com/questions/64695352/pandas-to-csv-
+            # progress-bar-with-tqdm
+            chunks = np.array_split(np.arange(dfall.shape[0]), 100)
+            chunks = [i for i in chunks if i.size > 0]
+
+            # The file is kept open rather than reopened for every chunk.
+            with open(filename, 'w', newline='', encoding='utf-8') as fno:
+                for chunck, subset in enumerate(self.piter(chunks)):
+                    dfall.iloc[subset].to_csv(fno, header=(chunck == 0),
+                                              index=False)
         else:
 
             if data.shape[0] > 1048576:
@@ -668,15 +805,21 @@ class ImportVector(BasicModule):
         os.chdir(os.path.dirname(self.ifile))
 
         if 'KML' in ext or '.kml' in self.ifile or '.kmz' in self.ifile:
-            gdf = gpd.read_file(self.ifile,  bbox=bounds, engine='fiona',
-                                allow_unsupported_drivers=True)
+            engine = 'fiona'
         else:
-            gdf = gpd.read_file(self.ifile, bbox=bounds, engine='pyogrio')
+            engine = 'pyogrio'
+
+        if bounds is not None:
+            bounds = tuple(bounds)
+
+        fstat = os.stat(self.ifile)
+        gdf = _read_vector(self.ifile, fstat.st_mtime_ns, fstat.st_size,
+                           bounds, engine)
 
         if bounds is not None:
             gdf = gdf.clip(mask=bounds)
 
-        gdf = gdf[gdf.geometry != None]
+        gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
         gdf = gdf.explode(ignore_index=True)
 
         if gdf.size == 0:
@@ -800,69 +943,221 @@ class ImportVector(BasicModule):
         self.saveobj(self.ifile)
 
 
-def get_GXYZ(ifile, showlog=print, piter=iter):
+@lru_cache(maxsize=8)
+def _read_vector(ifile, mtime, size, bounds=None, engine='pyogrio'):
     """
-    Get Geosoft XYZ.
+    Read a vector file, keeping recent results in a cache.
+
+    The modification time and size of the file are part of the cache key,
+    so a file which has changed on disk is read again.
+
+    Parameters
+    ----------
+    ifile : str
+        Input filename.
+    mtime : int
+        File modification time in nanoseconds.
+    size : int
+        File size in bytes.
+    bounds : tuple, optional
+        Bounds defined as (xmin, ymin, xmax, ymax). The default is None.
+    engine : str, optional
+        Engine used by geopandas, either 'pyogrio' or 'fiona'. The default
+        is 'pyogrio'.
 
     Returns
     -------
-    df2 : DataFrame
-        Pandas dataframe.
+    gdf : GeoDataFrame
+        Vector data. This is shared between calls and must not be changed
+        in place.
 
     """
-    with open(ifile, encoding='utf-8') as fno:
-        tmp = fno.read()
+    if engine == 'fiona':
+        gdf = gpd.read_file(ifile, bbox=bounds, engine='fiona',
+                            allow_unsupported_drivers=True)
+    else:
+        gdf = gpd.read_file(ifile, bbox=bounds, engine=engine,
+                            use_arrow=HAS_PYARROW)
 
-    chktxt = tmp[:tmp.index('\n')].lower()
+    return gdf
 
-    if r'/' not in chktxt and 'line' not in chktxt and 'tie' not in chktxt:
-        showlog('Not Geosoft XYZ format')
-        return None
 
-    while r'//' in tmp[:tmp.index('\n')]:
-        tmp = tmp[tmp.index('\n')+1:]
+def get_GXYZ(ifile, showlog=print, piter=iter, usecols=None,
+             headonly=False):
+    """
+    Get Geosoft XYZ.
+
+    Parameters
+    ----------
+    ifile : str
+        Input filename.
+    showlog : function, optional
+        Display information. The default is print.
+    piter : function, optional
+        Progress bar iterable. The default is iter.
+    usecols : list, optional
+        Columns to load. The default is None, which loads all columns.
+    headonly : bool, optional
+        Only read the column names. The default is False.
+
+    Returns
+    -------
+    df2 : DataFrame
+        Pandas dataframe.
+
+    """
+    # The file is memory mapped and handled as bytes, so that the whole
+    # file is never decoded to a string.
+    with open(ifile, 'rb') as fno:
+        mm = mmap.mmap(fno.fileno(), 0, access=mmap.ACCESS_READ)
 
-    head = None
+    with mm:
+        chktxt = mm.readline().decode('utf-8').lower()
 
-    while r'/' in tmp[:tmp.index('\n')]:
-        head = tmp[:tmp.index('\n')]
-        tmp = tmp[tmp.index('\n')+1:]
-        head = head.split()
-        head.pop(0)
+        if r'/' not in chktxt and 'line' not in chktxt and 'tie' not in chktxt:
+            showlog('Not Geosoft XYZ format')
+            return None
 
-    while r'/' in tmp:
-        t1 = tmp[:tmp.index(r'/')]
-        t2 = tmp[tmp.index(r'/')+1:]
-        t3 = t2[t2.index('\n')+1:]
-        tmp = t1+t3
+        # The last '/' line of the header holds the column names, while
+        # '//' lines are comments.
+        mm.seek(0)
+        pos = 0
+        head = None
+        for tmp in iter(mm.readline, b''):
+            if b'/' not in tmp:
+                break
+            if b'//' not in tmp:
+                head = tmp.decode('utf-8').split()[1:]
+            pos = mm.tell()
+
+        if headonly:
+            if head is None:
+                # Without a header, the first data row sets the columns.
+                mm.seek(pos)
+                for tmp in iter(mm.readline, b''):
+                    tmp = tmp.split()
+                    if tmp and not tmp[0].lower().startswith((b'line',
+                                                              b'tie')):
+                        break
+                head = [f'Column {i+1}' for i in range(len(tmp))]
+            return pd.DataFrame(columns=head+['line'])
+
+        # Remove the remaining comments in a single pass. Clean exports
+        # have none, in which case the regular expression is skipped. The
+        # newline is kept, so that a comment after data does not join its
+        # row to the next one.
+        if mm.find(b'/', pos) == -1:
+            tmp = mm[pos:]
+        else:
+            with memoryview(mm) as buf:
+                tmp = re.sub(rb'/[^\n]*', b'', buf[pos:])
 
-    tmp = tmp.lower()
+    # Line labels start a row, so match them there regardless of case
+    # rather than lower casing a copy of the whole file. Matching on the
+    # preceding newline is much faster than a multiline anchor, so the
+    # label at the start of the text is split off separately.
     tmp = tmp.lstrip()
-    tmp = re.split('(line|tie)', tmp)
-    if tmp[0] == '':
+    tmp = re.split(rb'\n[ \t]*(line|tie)', tmp, flags=re.IGNORECASE)
+    tmp[:1] = re.split(rb'^(line|tie)', tmp[0], flags=re.IGNORECASE)
+    if tmp[0] == b'':
         tmp.pop(0)
 
-    df2 = None
-    dflist = []
+    lines = []
+    nrows = []
+    nbad = 0
+    badlines = []
     for i in piter(range(0, len(tmp), 2)):
-        tmp2 = tmp[i+1]
-
-        line = tmp[i]+' '+tmp2[:tmp2.index('\n')].strip()
-        tmp2 = tmp2[tmp2.index('\n')+1:]
+        # The split consumes the newline ending each block, so the last
+        # row of a block need not end in one.
+        line, _, tmp2 = tmp[i+1].partition(b'\n')
+        line = (tmp[i]+b' '+line.strip()).decode('utf-8').lower()
         if head is None:
             head = [f'Column {i+1}' for i in
-                    range(len(tmp2[:tmp2.index('\n')].split()))]
+                    range(len(tmp2.partition(b'\n')[0].split()))]
+
+        # Rows with more fields than columns would shift the fields of
+        # other rows once all lines are parsed together, so drop them.
+        # Short rows are padded with NaN by read_csv.
+        nfields = count_fields(np.frombuffer(tmp2, dtype=np.uint8))
+        bad = nfields > len(head)
+        if bad.any():
+            tmp2 = b'\n'.join([j for j in tmp2.split(b'\n')
+                               if len(j.split()) <= len(head)])
+            nbad += int(bad.sum())
+            badlines.append(line)
+
+        lines.append(line)
+        nrows.append(int((~bad).sum()))
+        tmp[i+1] = tmp2
+
+    if nbad > 0:
+        showlog(f'Warning: {nbad} rows with more than {len(head)} fields '
+                f'were skipped, in {", ".join(badlines[:10])}'
+                f'{", ..." if len(badlines) > 10 else ""}.')
+        if sum(nrows) == 0:
+            showlog('Error: No rows match the column names.')
+            return None
 
-        tmp2 = tmp2.replace('*', 'NaN')
-        df1 = pd.read_csv(StringIO(tmp2), sep=r'\s+', names=head)
+    # Parsing all lines in a single read_csv call is much faster than
+    # parsing and concatenating one line at a time.
+    tmp = b'\n'.join(tmp[1::2])
+    if usecols is not None:
+        usecols = [i for i in head if i in usecols]
+    df2 = pd.read_csv(BytesIO(tmp), sep=r'\s+', names=head,
+                      index_col=False, na_values=GXYZ_NULLS, usecols=usecols)
+    del tmp
+
+    # The line labels repeat for every point, so store them as a
+    # categorical built from codes rather than as one string per row.
+    codes, labels = pd.factorize(np.array(lines))
+    df2['line'] = pd.Categorical.from_codes(np.repeat(codes, nrows),
+                                            categories=labels)
 
-        df1['line'] = line
-        dflist.append(df1)
+    return df2
 
-    # Concat in all df in one go is much faster
-    df2 = pd.concat(dflist, ignore_index=True)
 
-    return df2
+@jit(nopython=True)
+def count_fields(buf):
+    """
+    Count the fields in each data row of a block of text.
+
+    Data rows are lines with something other than whitespace on them,
+    which are the lines kept by read_csv. Fields are separated by
+    whitespace.
+
+    Parameters
+    ----------
+    buf : numpy array
+        Text encoded as an array of uint8.
+
+    Returns
+    -------
+    nfields : numpy array
+        Number of fields in each data row.
+
+    """
+    nfields = np.zeros((buf == 10).sum()+1, dtype=np.int64)
+    nrows = 0
+    cnt = 0
+    blank = True
+    for char in buf:
+        if char == 10:
+            if cnt > 0:
+                nfields[nrows] = cnt
+                nrows += 1
+            cnt = 0
+            blank = True
+        elif char in (9, 11, 12, 13, 32):
+            blank = True
+        elif blank:
+            cnt += 1
+            blank = False
+
+    if cnt > 0:
+        nfields[nrows] = cnt
+        nrows += 1
+
+    return nfields[:nrows]
 
 
 def get_intrepid(ifile, showlog=print, piter=iter):
@@ -972,6 +1267,32 @@ def get_intrepid(ifile, showlog=print, piter=iter):
     return df
 
 
+def shrink_dtypes(df):
+    """
+    Store repetitive text columns as categoricals.
+
+    Numeric columns keep their dtypes. Narrower integers can overflow
+    silently in later arithmetic, and whether a float column survives as
+    float32 would depend on its values.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Input data. Columns are replaced in place.
+
+    Returns
+    -------
+    df : DataFrame
+        Output data.
+
+    """
+    for col in df.select_dtypes(include='object').columns:
+        if df[col].nunique() < 0.5*len(df):
+            df[col] = df[col].astype('category')
+
+    return df
+
+
 def _test():
     """Test."""
     import sys